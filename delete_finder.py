@@ -25,12 +25,19 @@ Dependencies:
 """
 
 import tweepy
-from tinydb import TinyDB as tinydb, Query
+import tweepy.asynchronous
+from tinydb import TinyDB as tinydb
+from tinydb.storages import JSONStorage
+from tinydb.middlewares import CachingMiddleware
 import time
+import asyncio
 from war_retweets import backup_database
 import shutil
 
 WAIT_TIME = 30
+# Twitter rate limits are per 15-minute window, so this many checks can
+# be in flight at once; wait_on_rate_limit handles the throttling
+MAX_CONCURRENT_CHECKS = 15
 api_key = 'replace this with real info'
 api_key_secret = 'replace this with real info'
 api_access_token = 'replace this with real info'
@@ -38,26 +45,26 @@ api_access_token_secret = 'replace this with real info'
 bearer = 'replace this with real info'
 
 
-def deleted_check(tweet, client):
+async def deleted_check(tweet, client):
     """
     Checks if a tweet has been deleted by attempting to retrieve its
     retweeters. Returns True if the tweet is considered deleted.
     """
-    time.sleep(WAIT_TIME)
     try:
-        temp = client.get_retweeters(tweet)
+        temp = await client.get_retweeters(tweet)
     except ConnectionResetError as e:
         print(e, flush=True)
         print('Trying again')
-        time.sleep(WAIT_TIME)
-        client = tweepy.Client(bearer_token=bearer,
-                               consumer_key=api_key,
-                               consumer_secret=api_key_secret,
-                               access_token=api_access_token,
-                               access_token_secret=api_access_token_secret,
-                               wait_on_rate_limit=True)
-        temp = client.get_retweeters(tweet)
-        
+        await asyncio.sleep(WAIT_TIME)
+        client = tweepy.asynchronous.AsyncClient(
+            bearer_token=bearer,
+            consumer_key=api_key,
+            consumer_secret=api_key_secret,
+            access_token=api_access_token,
+            access_token_secret=api_access_token_secret,
+            wait_on_rate_limit=True)
+        temp = await client.get_retweeters(tweet)
+
     if temp.data is None:
         print('0 Retweets, skipping')
         return True
@@ -71,70 +78,111 @@ def deleted_check(tweet, client):
             return True
 
 
-def check_tweet_list(tweet_ids, client, db):
+async def check_tweet_list(tweet_ids, client, db, by_id):
     """
-    Processes a list of tweet IDs, updates their status in the database,
-    and checks if they have been deleted.
+    Processes a list of tweet IDs concurrently, updates their status in
+    the database, and checks if they have been deleted. Documents are
+    looked up in the by_id dict index rather than with a TinyDB linear
+    scan, and status writes go through doc_ids - an O(1) dict lookup in
+    TinyDB instead of a scan per update. Returns the number of deletes
+    found.
     """
+    doc_ids = {}
+    to_insert, to_mark = [], []
     for tweet_id in tweet_ids:
-        try:
-            print('\n Processing', tweet_id)
-            qu = Query()
-            doc = db.search(qu['id'] == tweet_id)
-            doc = doc[0] if doc else None
-            if not doc:
-                db.insert({'id': tweet_id, 'status': 'unchecked'})
-            elif 'status' not in doc:
+        doc = by_id.get(tweet_id)
+        if not doc:
+            doc = {'id': tweet_id, 'status': 'unchecked'}
+            to_insert.append(doc)
+            by_id[tweet_id] = doc
+        else:
+            doc_ids[tweet_id] = doc.doc_id
+            if 'status' not in doc:
                 doc['status'] = 'unchecked'
-                db.update(doc, qu['id'] == tweet_id)
-            else:
-                pass
-            deleted = deleted_check(tweet_id, client)
-            if not deleted:
-                db.update({'status': 'checked'}, qu.id == tweet_id)
-            else:
-                print(f'\nFound a delete {tweet_id}', flush=True)
-                db.update({'status': 'deleted'}, qu.id == tweet_id)
-            return deleted
-        except Exception as e:
-            print(e)
+                to_mark.append(doc.doc_id)
+    # each TinyDB mutation rewrites the whole JSON file, so batch the
+    # bookkeeping writes into one insert and one update
+    if to_insert:
+        for new_doc, new_id in zip(to_insert, db.insert_multiple(to_insert)):
+            doc_ids[new_doc['id']] = new_id
+    if to_mark:
+        db.update({'status': 'unchecked'}, doc_ids=to_mark)
 
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
 
-def script(db_name):
-    """
-    Main script for processing tweets stored in a database. Backs up the
-    database, checks each tweet for deletion, and updates their status.
-    """
-    backup_dir = '/home/josh/backups/'
-    backup_database(db_name, backup_dir)
-    client = tweepy.Client(bearer_token=bearer,
-                           consumer_key=api_key,
-                           consumer_secret=api_key_secret,
-                           access_token=api_access_token,
-                           access_token_secret=api_access_token_secret,
-                           wait_on_rate_limit=True)
-    new_db = f'{db_name}.delete'
-    shutil.copyfile(db_name, new_db)
-    db = tinydb(new_db)
-    docs_missing_status = [doc for doc in db if 'status' not in doc]
-    num_docs = len(docs_missing_status)
+    async def check_one(tweet_id):
+        async with semaphore:
+            print('\n Processing', tweet_id)
+            return tweet_id, await deleted_check(tweet_id, client)
+
+    num_docs = len(tweet_ids)
     num_processed, start_time, count = 0, time.time(), 0
-    for doc in docs_missing_status:
-        deleted = check_tweet_list([doc['id']], client, db)
+    checked_ids, deleted_ids = [], []
+    tasks = [asyncio.ensure_future(check_one(t)) for t in tweet_ids]
+    for task in asyncio.as_completed(tasks):
+        try:
+            tweet_id, deleted = await task
+        except Exception as e:
+            print(e)
+            continue
+        if not deleted:
+            checked_ids.append(doc_ids[tweet_id])
+        else:
+            print(f'\nFound a delete {tweet_id}', flush=True)
+            deleted_ids.append(doc_ids[tweet_id])
         count += int(deleted)
         num_processed += 1
         num_remaining = num_docs - num_processed
         elapsed_time = time.time() - start_time
-        avg_time_per_doc = (elapsed_time / num_processed 
+        avg_time_per_doc = (elapsed_time / num_processed
                             if num_processed > 0 else 0)
         estimated_time_remaining = avg_time_per_doc * num_remaining
         print(f"{num_processed} out of {num_docs} processed. "
               f"{num_remaining} remaining. {count = }")
         elapsed_time_str = time.strftime('%H:%M', time.gmtime(elapsed_time))
-        est_time_rem_str = time.strftime('%H:%M', 
+        est_time_rem_str = time.strftime('%H:%M',
                                          time.gmtime(estimated_time_remaining))
         print(f"Elapsed time: {elapsed_time_str}. Estimated time remaining: "
               f"{est_time_rem_str}.")
+    # two grouped writes instead of one full-file rewrite per tweet
+    if checked_ids:
+        db.update({'status': 'checked'}, doc_ids=checked_ids)
+    if deleted_ids:
+        db.update({'status': 'deleted'}, doc_ids=deleted_ids)
+    return count
+
+
+def script(db_name):
+    """
+    Main script for processing tweets stored in a database. Backs up the
+    database, checks each tweet for deletion, and updates their status.
+    """
+    backup_dir = '/home/josh/backups/'
+    backup_database(db_name, backup_dir)
+    client = tweepy.asynchronous.AsyncClient(
+        bearer_token=bearer,
+        consumer_key=api_key,
+        consumer_secret=api_key_secret,
+        access_token=api_access_token,
+        access_token_secret=api_access_token_secret,
+        wait_on_rate_limit=True)
+    new_db = f'{db_name}.delete'
+    shutil.copyfile(db_name, new_db)
+    # CachingMiddleware batches mutations in memory so TinyDB does not
+    # rewrite the whole JSON file on every write; flushed explicitly
+    db = tinydb(new_db, storage=CachingMiddleware(JSONStorage))
+    # one pass over the db builds the id index and finds the docs that
+    # still need a status check
+    by_id = {}
+    ids_missing_status = []
+    for doc in db.all():
+        by_id[doc['id']] = doc
+        if 'status' not in doc:
+            ids_missing_status.append(doc['id'])
+    count = asyncio.run(check_tweet_list(ids_missing_status, client, db,
+                                         by_id))
+    db.storage.flush()
+    print(f'\nFound {count} deletes')
     input('\nPress enter to continue \n')
     print('Copying new docs to', new_db)
     old_db = tinydb(db_name)
@@ -143,6 +191,7 @@ def script(db_name):
         if doc['id'] not in id_set:
             db.insert(doc)
     old_db.close()
+    db.close()
     print(f'Done. Rename {new_db} to use.')
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+"""
+One-off migration of the TinyDB JSON database into SQLite.
+
+TinyDB keeps the whole database in a single JSON file that it rewrites on
+every mutation and scans linearly on every query. SQLite gives indexed
+O(log n) lookups, WAL-mode concurrent reads, and single-page writes, which
+is a much better fit for the sizes war_retweets_db.json has grown to.
+
+Common query fields (id, author_id, media_key, duration_ms, status) become
+indexed columns; everything else in a document is preserved in an 'extra'
+JSON column so no data is lost.
+
+Usage:
+Run the script with the TinyDB file as an optional argument. It writes a
+.sqlite file next to the source and leaves the JSON file untouched.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+
+COLUMNS = ['id', 'author_id', 'media_key', 'duration_ms', 'status',
+           'text', 'type', 'timestamp']
+INDEXED = ['id', 'author_id', 'media_key', 'duration_ms', 'status']
+
+
+def import_database(json_name, sqlite_name=None):
+    """
+    Imports a TinyDB JSON database into a new SQLite database.
+
+    Args:
+    - json_name (str): Path to the TinyDB JSON file.
+    - sqlite_name (str, optional): Path of the SQLite file to create.
+    Defaults to the JSON name with a .sqlite extension.
+
+    Returns:
+    - str: The path of the SQLite database written.
+    """
+    if sqlite_name is None:
+        sqlite_name = os.path.splitext(json_name)[0] + '.sqlite'
+
+    with open(json_name) as f:
+        data = json.load(f)
+    docs = list(data.get('_default', {}).values())
+
+    con = sqlite3.connect(sqlite_name, isolation_level=None)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS tweets ('
+        'id TEXT, author_id TEXT, media_key TEXT, duration_ms INTEGER, '
+        'status TEXT, text TEXT, type TEXT, timestamp INTEGER, extra TEXT)')
+
+    rows = []
+    for doc in docs:
+        extra = {k: v for k, v in doc.items() if k not in COLUMNS}
+        rows.append(tuple(doc.get(c) for c in COLUMNS) +
+                    (json.dumps(extra),))
+
+    # one transaction for the whole import instead of a commit per row
+    con.execute('BEGIN')
+    con.executemany('INSERT INTO tweets VALUES (?,?,?,?,?,?,?,?,?)', rows)
+    con.execute('COMMIT')
+
+    for col in INDEXED:
+        con.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_{col} ON tweets({col})')
+    con.close()
+    print(f'Imported {len(rows)} tweets into {sqlite_name}')
+    return sqlite_name
+
+
+if __name__ == '__main__':
+    json_name = sys.argv[1] if len(sys.argv) > 1 else 'war_retweets_db.json'
+    import_database(json_name)
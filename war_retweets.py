@@ -29,20 +29,44 @@ import re
 import os
 import time
 import tweepy
+import threading
 import requests
 from shutil import copyfile
 from datetime import datetime
-from tinydb import TinyDB as tinydb, Query
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tinydb import TinyDB as tinydb
 from tie_detector import tie_detector, download_tweet_video
+try:
+    from datasketch import MinHash, MinHashLSH
+except ImportError:
+    MinHash = MinHashLSH = None
 
 fibonacci_index = 7
 SAMENESS_RATIO = 0.7
-RETWEET_LIMIT_SEC = 1320 # 22 minutes  
+MINHASH_PERMS = 64
+# LSH prunes on estimated Jaccard similarity, but SAMENESS_RATIO gates
+# containment (|shared| / |candidate words|), and Jaccard is always the
+# smaller of the two - a short tweet mostly contained in a long one can
+# have containment 0.8 at Jaccard 0.25. Band the LSH well below the
+# ratio so it only prefilters and never drops such pairs.
+LSH_THRESHOLD = 0.2
+# guards word_sets/lsh: evaluate() workers read them while the consumer
+# thread adds each new retweet (neither dict iteration nor datasketch
+# is safe against concurrent mutation)
+_sameness_lock = threading.Lock()
+RETWEET_LIMIT_SEC = 1320 # 22 minutes
+# clips shorter than this are too brief for a tie to matter, so the
+# download + YOLO stage is skipped for them
+TIE_MIN_DURATION_MS = 3000
 BADS = ['mq-9', 'sadam', 'erbil', 'iraq', 'iran', 'osama', 'nft', '#nft', 
         'podcast', 'biden', 'ww3', 'hillary', 'trump', 'queen', 
         'pakistan', 'taliban', 'lavrov', 'ccp', 'communist', 'anything', 
         'konashenkov', 'marjorie', 'uysk', 'mq', 'removed', 'somalia',
         'boxer', 'sudan']
+# One compiled alternation scans each tweet once, instead of running
+# re.findall per bad word per tweet inside the hot loop
+_BAD_RE = re.compile('|'.join(map(re.escape, BADS + [x + 's' for x in BADS])))
 
 api_key = 'replace this with real info'
 api_key_secret = 'replace this with real info'
@@ -53,26 +77,70 @@ fibonacci = lambda n: int(((1 + 5**0.5) / 2)**n / 5**0.5 + 0.5)
 
 
 
-def matches_finder(tweet, db):
+def build_indexes(db):
     """
-    Searches a database for tweets matching the given tweet by media key, ID, 
-    or duration.
+    Builds in-memory dict indexes over every document in the database.
+
+    TinyDB answers every Query() search with a linear scan over all
+    documents, which dominates runtime once the database grows. These
+    indexes are built once per run and consulted instead of db.search.
+
+    Args:
+    - db (TinyDB): The database instance to index.
+
+    Returns:
+    - dict: Indexes keyed 'by_id', 'by_media_key', 'by_duration',
+    'by_author', each mapping a field value to its document(s).
+    """
+    indexes = {'by_id': {}, 'by_media_key': {},
+               'by_duration': defaultdict(list),
+               'by_author': defaultdict(list),
+               # memoized deleted_check percentages, cleared per author
+               # whenever that author gains a tweet
+               'author_pct': {}}
+    for doc in db.all():
+        index_tweet(indexes, doc)
+    return indexes
+
+def index_tweet(indexes, doc):
+    """
+    Adds a single tweet document to the in-memory indexes.
+
+    Args:
+    - indexes (dict): The indexes built by build_indexes.
+    - doc (dict): The tweet document to index.
+    """
+    if doc.get('id') is not None:
+        indexes['by_id'][doc['id']] = doc
+    if doc.get('media_key') is not None:
+        indexes['by_media_key'][doc['media_key']] = doc
+    if doc.get('duration_ms') is not None:
+        indexes['by_duration'][doc['duration_ms']].append(doc)
+    if doc.get('author_id') is not None:
+        indexes['by_author'][doc['author_id']].append(doc)
+        indexes['author_pct'].pop(doc['author_id'], None)
+
+def matches_finder(tweet, indexes):
+    """
+    Searches the indexed database for tweets matching the given tweet by
+    media key, ID, or duration.
     Outputs relevant messages and returns True if a match is found, else False.
-    
+
     Args:
     - tweet (dict): A dictionary containing details of the tweet to match.
-    - db (TinyDB): The database instance to search in.
-    
+    - indexes (dict): In-memory indexes built by build_indexes.
+
     Returns:
     - bool: True if a match is found, False otherwise.
     """
-    Tweet = Query()
-    mkey, duration, tid = tweet.get('media_key'), tweet.get('duration_ms'), 
-    tweet.get('id')
-    
-    matches = db.search((Tweet.media_key == mkey) | (Tweet.id == tid) )
-    dur_matches = db.search(Tweet.duration_ms == duration)
-    
+    mkey = tweet.get('media_key')
+    duration = tweet.get('duration_ms')
+    tid = tweet.get('id')
+
+    matches = (indexes['by_media_key'].get(mkey) or
+               indexes['by_id'].get(tid))
+    dur_matches = indexes['by_duration'].get(duration, [])
+
     if matches:
         print('Found non-duration match')
         return True
@@ -87,10 +155,21 @@ def matches_finder(tweet, db):
                 print('DL failed, returning False', e)
                 return False
             error = compare_file_sizes(new, old)
-            os.remove(old)
-            if error:
-                return error < 10
-            else: return False
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                # another worker matching the same stored tweet may
+                # have removed it already
+                pass
+            matched = bool(error) and error < 10
+            if matched:
+                # a rejected candidate never reaches tie_detector's
+                # cleanup, so drop its own download here
+                try:
+                    os.remove(new)
+                except FileNotFoundError:
+                    pass
+            return matched
     else:
         return False
             
@@ -135,82 +214,165 @@ def connect_to_endpoint(url, params):
     return response.json()
 
     
-def sameness_efficient(tweet, db):
+def words_minhash(words):
+    """
+    Builds a MinHash signature for a collection of words.
+
+    Args:
+    - words: An iterable of word strings.
+
+    Returns:
+    - MinHash: The signature for LSH insertion or querying.
+    """
+    mh = MinHash(num_perm=MINHASH_PERMS)
+    for w in words:
+        mh.update(w.encode())
+    return mh
+
+def add_to_sameness_index(word_sets, lsh, tweet_id, words):
+    """
+    Registers a tweet's words with the sameness index.
+
+    Args:
+    - word_sets (dict): Maps tweet id to its frozenset of words.
+    - lsh (MinHashLSH or None): The LSH index, if datasketch is available.
+    - tweet_id (str): The tweet's id, used as the index key.
+    - words: The tweet's words.
+    """
+    with _sameness_lock:
+        if tweet_id is None or tweet_id in word_sets:
+            return
+        word_sets[tweet_id] = frozenset(words)
+        if lsh is not None:
+            lsh.insert(tweet_id, words_minhash(words))
+
+def build_sameness_index(db):
+    """
+    Builds the sameness index over every stored tweet.
+
+    When datasketch is installed this includes a MinHash LSH index, so
+    each candidate tweet only does exact set intersections against its
+    few LSH-nearest neighbours instead of every stored tweet. Without
+    datasketch, the exact full scan over the cached word sets is kept.
+
+    Args:
+    - db (TinyDB): The database instance to index.
+
+    Returns:
+    - tuple: (word_sets dict, MinHashLSH or None).
+    """
+    lsh = None
+    if MinHashLSH is not None:
+        lsh = MinHashLSH(threshold=LSH_THRESHOLD, num_perm=MINHASH_PERMS)
+    word_sets = {}
+    for doc in db.all():
+        add_to_sameness_index(word_sets, lsh, doc.get('id'),
+                              doc.get('words', []))
+    return word_sets, lsh
+
+def sameness_efficient(tweet, word_sets, lsh=None):
     """
     Evaluates if a given tweet is similar to any previously stored tweets in 
     a database based on word overlap.
 
-    This function compares the words in the given tweet against the words in 
-    tweets stored in the database. It calculates the ratio of the longest 
-    common word set to the total number of words in the tweet. If this ratio 
-    exceeds a predefined threshold (SAMENESS_RATIO), 
-    the function indicates a 'sameness alert'.
+    This function compares the words in the given tweet against word sets
+    precomputed once per run from the stored tweets. When an LSH index is
+    supplied, only the approximate-Jaccard neighbours it returns are
+    checked exactly; otherwise every cached word set is. It calculates
+    the ratio of the longest common word set to the total number of words
+    in the tweet. If this ratio exceeds a predefined threshold
+    (SAMENESS_RATIO), the function indicates a 'sameness alert'.
 
     Args:
     - tweet (str): The tweet text to be evaluated.
-    - db (list): A list of dictionaries, where each dictionary represents a 
-    tweet with a 'words' key.
+    - word_sets (dict): Maps tweet id to its frozenset of words.
+    - lsh (MinHashLSH, optional): The LSH index over stored tweets.
 
     Returns:
-    - bool: True if the sameness ratio exceeds the predefined threshold, 
+    - bool: True if the sameness ratio exceeds the predefined threshold,
     False otherwise.
     """
     tweet_words = set(tweet.lower().split())
-    previous_tweets = [set(x.get('words')) for x in db]
-    longest_previous = max(len(tweet_words & y) for y in previous_tweets)
-    ratio = longest_previous / len(tweet_words)
-    if ratio > SAMENESS_RATIO: 
-        print('\nSameness alert\n{}\n{}'.format(ratio, tweet))
-        return True
-    else:
-        print('\nSameness ratio:', ratio)
+    if not word_sets:
         return False
+    # snapshot the candidates under the lock; the frozensets themselves
+    # are immutable so the intersections below run without it
+    with _sameness_lock:
+        if lsh is not None:
+            hits = lsh.query(words_minhash(tweet_words))
+            candidates = [word_sets[h] for h in hits if h in word_sets]
+        else:
+            candidates = list(word_sets.values())
+    if lsh is not None and not candidates:
+        print('\nSameness ratio: 0 (no LSH candidates)')
+        return False
+    # stop at the first intersection over the threshold rather than
+    # computing every one just to take the max
+    threshold = SAMENESS_RATIO * len(tweet_words)
+    longest_previous = 0
+    for y in candidates:
+        inter = len(tweet_words & y)
+        if inter > threshold:
+            ratio = inter / len(tweet_words)
+            print('\nSameness alert\n{}\n{}'.format(ratio, tweet))
+            return True
+        if inter > longest_previous:
+            longest_previous = inter
+    ratio = longest_previous / len(tweet_words)
+    print('\nSameness ratio:', ratio)
+    return False
     
-def deleted_check(tweet, db):
+def deleted_check(tweet, indexes):
     """
-    Checks if a significant percentage of an author's previous tweets have 
+    Checks if a significant percentage of an author's previous tweets have
     been deleted.
-    
-    This function searches a database for tweets by the same author and 
-    calculates the percentage of those tweets that have been marked as 
-    'deleted'. Depending on the number of previous tweets, different 
-    thresholds are applied to determine if a significant percentage of tweets 
-    have been deleted.
-    
+
+    This function looks up the author's previous tweets in the in-memory
+    indexes and calculates the percentage of those tweets that have been
+    marked as 'deleted'. Depending on the number of previous tweets,
+    different thresholds are applied to determine if a significant
+    percentage of tweets have been deleted.
+
     Args:
-    - tweet (dict): A dictionary containing the tweet data, including the 
+    - tweet (dict): A dictionary containing the tweet data, including the
     'author_id'.
-    - db (TinyDB): The database instance to search in.
-    
+    - indexes (dict): In-memory indexes built by build_indexes.
+
     Returns:
-    - bool: True if the deletion percentage exceeds the set threshold, False 
+    - bool: True if the deletion percentage exceeds the set threshold, False
     otherwise.
     """
-    # Create a query object
-    qu = Query()
-    # Search the database for previous tweets with the same ID 
-    previous_tweets = db.search(qu['author_id'] == tweet.get('author_id'))
-    
+    # Look up previous tweets by the same author
+    author_id = tweet.get('author_id')
+    previous_tweets = indexes['by_author'].get(author_id, [])
+
     # If there are no previous tweets with the same ID return False
     if not previous_tweets:
         print('\nNo previous tweets, retweeting')
         return False
-    
+
     # Otherwise, print a message and check the previous tweets for deletions
     else:
         print(f'\nChecking previous {len(previous_tweets)} tweets for deletes')
-        delete_count = 0
-        
-        # Loop through the previous tweets
-        for previous in previous_tweets:
-            previous_status = db.get(qu['id'] == previous['id']).get('status')
-            
-            # If the status field is 'deleted', increment the delete count
-            if previous_status == 'deleted':
-                delete_count += 1
-            
-        # Calculate the percentage of previous tweets that were deleted
-        delete_percentage = int((delete_count / len(previous_tweets)) * 100)
+
+        # Authors often show up several times per run, so memoize the
+        # percentage; index_tweet invalidates it when the author changes
+        delete_percentage = indexes['author_pct'].get(author_id)
+        if delete_percentage is None:
+            delete_count = 0
+
+            # Loop through the previous tweets
+            for previous in previous_tweets:
+                previous_status = previous.get('status')
+
+                # If the status field is 'deleted', increment delete count
+                if previous_status == 'deleted':
+                    delete_count += 1
+
+            # Calculate the percentage of previous tweets deleted
+            delete_percentage = int(
+                (delete_count / len(previous_tweets)) * 100)
+            indexes['author_pct'][author_id] = delete_percentage
         print(f'\n{delete_percentage}% of previous tweets have been deleted')
         # Return True if the delete percentage is > threshold, otherwise False
         if len(previous_tweets) <= 3:
@@ -282,6 +444,10 @@ def script():
     # fill the database 
     db = tinydb(db_filename)
     print(f'\nLoaded {len(db)} previous retweets', flush=True)
+    # index the db once so the per-tweet checks avoid TinyDB linear scans
+    indexes = build_indexes(db)
+    # sameness index (word sets plus LSH), built once instead of per tweet
+    word_sets, lsh = build_sameness_index(db)
     for loops in range(5):
         # setup client
         client = tweepy.Client(bearer_token = bearer,
@@ -323,62 +489,82 @@ def script():
                     print('no media data')
             else:
                 print('no attachs')
-        # define a list of words to avoid          
-        bads = BADS + [x + 's' for x in BADS]
         sent = 0
-                 
-        for tweet in allTweets:
+
+        def evaluate(tweet):
+            """
+            Runs every per-tweet check and returns (tweet, tests), where
+            tests lists the rejection flags in category order: Author,
+            Sameness, Bad Words, Not Video, Matches, Pr. Deletes,
+            Tie Seen. Cheap checks short-circuit the expensive ones.
+            """
             print('\nProcessing:', tweet, flush=True)
-            # check if the tweet id, media_key, duration is already in the db.
             tweet_id = tweet.get('id')
-            previous_deletes = deleted_check(tweet, db)
+            previous_deletes = deleted_check(tweet, indexes)
             if previous_deletes:
-                print('\nSkipping, too many previous deletes', tweet_id, '\n')
-                continue
-            bad_test = [not not re.findall(x, 
-                                    tweet.get('text').lower()) for x in bads]
-            # check if there's any reason to reject the tweet
-            easys = [tweet.get('author_id') in users, 
-                     sameness_efficient(tweet.get('text'), db), any(bad_test), 
+                return tweet, [False, False, False, False,
+                               False, True, False]
+            has_bad = bool(_BAD_RE.search(tweet.get('text').lower()))
+            easys = [tweet.get('author_id') in users,
+                     sameness_efficient(tweet.get('text'), word_sets,
+                                        lsh), has_bad,
                      tweet.get('type') != 'video']
             if any(easys):
-                print('\nSkipping', tweet_id, '\n')
-                categories = (
-                    'Author, Sameness, Bad Words, Not Video'
-                    .split(', '))
-                results = "\n".join(f"{a:.^15} {b}\n" for a, b 
-                                    in zip(categories, easys))
-                print(results)                
-                continue
-            matches = matches_finder(tweet, db)
+                return tweet, easys + [False, False, False]
+            matches = matches_finder(tweet, indexes)
             if matches:
-                print('\nMatches - skipping', tweet_id, '\n')
-                continue
-            try:
-                tie_seen = tie_detector(tweet_id)            
-            except Exception as e:    
+                return tweet, easys + [True, False, False]
+            # gate the heavy download + YOLO stage on cheap metadata
+            if tweet.get('duration_ms', 0) < TIE_MIN_DURATION_MS:
                 tie_seen = False
-                print(e)
-            bool_list = [matches, previous_deletes, tie_seen]
-            tests = easys
-            tests.extend(bool_list)
-            categories = (
-                'Author, Sameness, Bad Words, Not Video, Matches, '
-                'Pr. Deletes, Tie Seen'.split(', ')
-            )
-            results = "\n".join(
-                f"{a:.^15} {b}\n" for a, b in zip(categories, tests)
-            )
-
-            print(results)                
-            if tie_seen:
-                print('\nTie seen - skipping', tweet_id, '\n')
-                continue
-            # if no reason to reject then add it to the db, retweet, and wait
-            if not any(tests):
+            else:
+                try:
+                    tie_seen = tie_detector(tweet_id)
+                except Exception as e:
+                    tie_seen = False
+                    print(e)
+            return tweet, easys + [matches, previous_deletes, tie_seen]
+
+        categories = (
+            'Author, Sameness, Bad Words, Not Video, Matches, '
+            'Pr. Deletes, Tie Seen'.split(', ')
+        )
+        # the checks are I/O-bound (video downloads, YOLO) and
+        # independent per tweet, so evaluate them concurrently; only the
+        # retweet + wait phase below stays serialized
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [pool.submit(evaluate, t) for t in allTweets]
+            for future in as_completed(futures):
+                tweet, tests = future.result()
+                tweet_id = tweet.get('id')
+                results = "\n".join(
+                    f"{a:.^15} {b}\n" for a, b in zip(categories, tests)
+                )
+                print(results)
+                if any(tests):
+                    print('\nSkipping', tweet_id, '\n')
+                    continue
+                # two tweets by one author can pass evaluation
+                # concurrently, so re-check the author here
+                if tweet.get('author_id') in users:
+                    print('\nSkipping, repeat author', tweet_id, '\n')
+                    continue
+                # likewise two copies of one video can both pass when
+                # evaluated against pre-batch state, so re-run the
+                # sameness and match checks against what has been
+                # retweeted since - cheap now that they are index-backed
+                if (sameness_efficient(tweet.get('text'), word_sets, lsh)
+                        or matches_finder(tweet, indexes)):
+                    print('\nSkipping, duplicate within batch',
+                          tweet_id, '\n')
+                    continue
+                # no reason to reject: add it to the db, retweet, and wait
                 users.append(tweet.get('author_id'))
-                try:                    
+                try:
                     db.insert(tweet)
+                    index_tweet(indexes, tweet)
+                    add_to_sameness_index(word_sets, lsh, tweet_id,
+                                          tweet['words'])
                     client.retweet(tweet_id)
                     print('\nRetweeted', tweet_id)
                     sent += 1
@@ -394,7 +580,7 @@ def script():
                     time.sleep(RETWEET_LIMIT_SEC)
                 except tweepy.errors.BadRequest as e:
                     print(e, flush=True)
-    
+
                 except ConnectionResetError as e:
                     print(e, flush=True)
                     print('Trying again')
@@ -403,11 +589,14 @@ def script():
                        consumer_secret = api_key_secret,
                        access_token = api_access_token,
                        access_token_secret = api_access_token_secret,
-                       wait_on_rate_limit=True)   
+                       wait_on_rate_limit=True)
                     client.retweet(tweet_id)
 
 
-            if sent > 10: break
+                if sent > 10:
+                    for pending in futures:
+                        pending.cancel()
+                    break
 
 if __name__ == '__main__':
     